@@ -0,0 +1,341 @@
+import os
+import wave
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+SAMPLE_RATE = 11025  # Everything is decoded to mono at this rate
+MAX_SECONDS = 90  # Only the start of each file is fingerprinted
+FRAME, HOP = 2048, 256  # 5.4 Hz bins, 23 ms frames
+PEAK_TIME, PEAK_FREQ = 6, 10  # A peak is the maximum of its +-frames x +-bins neighbourhood
+PEAK_FLOOR = 1.0  # and exceeds the median log magnitude by this much
+# Hashes are thinned by anchor, not by hash value: only anchors start pairs, so every kept hash
+# still spans the full 32-bit space
+ANCHOR_BANDS = [0, 64, 192, 448, 1025]  # rfft bin edges; anchors are chosen per band
+ANCHOR_TIME = 16  # An anchor is also the strongest peak of its band within +-frames (~0.4 s)
+FAN_OUT = 4  # Following peaks paired with each anchor
+MAX_DT = 255  # Max frames between paired peaks (~5.9 s)
+FREQ_BITS, DT_BITS = 11, 10  # Hash = f1 (half-bin) | f2 (half-bin) | dt
+MIN_POSTING = 32  # Hashes in more than max(MIN_POSTING, n * POSTING_FRACTION) files are too common to vote,
+POSTING_FRACTION = 0.002  # growing with the library while the lists under the cap expand to <= PAIR_BUDGET pairs
+PAIR_BUDGET = 1 << 28  # Bounds matching time
+PAIR_BATCH = 1 << 22  # File pairs voted on per block of files (bounds memory)
+DT_OFFSET = 1 << 16  # Shifts time offsets (uint16 frame deltas) to non-negative
+MIN_VOTES = 6  # Offset-consistent shared hashes needed to call two files duplicates
+DUP_THRESHOLD = 0.15  # Matched IDF mass / IDF mass of the smaller file
+CACHE_VERSION = 2  # Bump when the hash layout changes; older caches are refingerprinted
+
+
+def _decode_wav(path):
+    # WAV via the stdlib: downmix and linearly resample to SAMPLE_RATE
+    with wave.open(path, "rb") as w:
+        rate, channels, width = w.getframerate(), w.getnchannels(), w.getsampwidth()
+        raw = w.readframes(min(w.getnframes(), rate * MAX_SECONDS))
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width in (2, 4):
+        dtype = np.int16 if width == 2 else np.int32
+        samples = np.frombuffer(raw, dtype=dtype).astype(np.float32) / np.iinfo(dtype).max
+    else:
+        return None
+    samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    if rate != SAMPLE_RATE and len(samples):
+        n = int(len(samples) * SAMPLE_RATE / rate)
+        samples = np.interp(np.arange(n) * (rate / SAMPLE_RATE), np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+
+def _decode_pygame(path):
+    # mp3/ogg (and odd WAVs) via pygame; the worker mixer is initialised at SAMPLE_RATE mono
+    import pygame
+    sound = pygame.mixer.Sound(path)
+    samples = pygame.sndarray.array(sound).astype(np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    return samples[:SAMPLE_RATE * MAX_SECONDS] / 32768.0
+
+
+def decode(path):
+    # Mono float32 samples at SAMPLE_RATE, or None if the file can't be read
+    if path.lower().endswith(".wav"):
+        try:
+            samples = _decode_wav(path)
+            if samples is not None:
+                return samples
+        except (OSError, wave.Error, EOFError):
+            pass
+    return _decode_pygame(path)
+
+
+def _running_max(a, radius, axis):
+    # Max over a centred window of 2 * radius + 1 along axis (edges padded with -inf), by doubling
+    a = np.moveaxis(a, axis, 0)
+    n, width = len(a), 2 * radius + 1
+    pad = np.full((radius,) + a.shape[1:], -np.inf, dtype=a.dtype)
+    m = np.concatenate([pad, a, pad])
+    span = 1
+    while span * 2 <= width:
+        m = np.maximum(m[:-span], m[span:])
+        span *= 2
+    return np.moveaxis(np.maximum(m[:n], m[width - span:width - span + n]), 0, axis)
+
+
+def spectral_peaks(samples):
+    # Local maxima of the log spectrogram -> (frame, half-bin frequency, is_anchor), sorted by time.
+    # Anchors also dominate their band over +-ANCHOR_TIME frames, so the same ones are picked
+    # whatever the file's start offset
+    empty = np.empty(0, dtype=np.int32)
+    if len(samples) < FRAME:
+        return empty, empty, np.empty(0, dtype=bool)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME)[::HOP]
+    window = np.hanning(FRAME).astype(np.float32)
+    spec = np.empty((len(frames), FRAME // 2 + 1), dtype=np.float32)
+    for lo in range(0, len(frames), 512):  # Blocks bound the complex128 temporaries
+        spec[lo:lo + 512] = np.log1p(np.abs(np.fft.rfft(frames[lo:lo + 512] * window, axis=1)))
+    floor = np.median(spec[::4]) + PEAK_FLOOR
+    peak = (spec == _running_max(_running_max(spec, PEAK_TIME, 0), PEAK_FREQ, 1)) & (spec > floor)
+    anchor = np.zeros_like(peak)
+    for lo, hi in zip(ANCHOR_BANDS[:-1], ANCHOR_BANDS[1:]):
+        strongest = _running_max(spec[:, lo:hi].max(axis=1), ANCHOR_TIME, 0)
+        anchor[:, lo:hi] = peak[:, lo:hi] & (spec[:, lo:hi] == strongest[:, None])
+    times, bins = np.nonzero(peak)  # Row-major: sorted by time, then frequency
+    # Parabolic interpolation around the peak bin, quantized to half bins
+    inner = np.clip(bins, 1, spec.shape[1] - 2)
+    a, b, c = spec[times, inner - 1], spec[times, inner], spec[times, inner + 1]
+    curve = a - 2 * b + c
+    delta = np.where(curve < 0, 0.5 * (a - c) / np.where(curve < 0, curve, -1), 0.0)
+    delta = np.where(inner == bins, np.clip(delta, -0.5, 0.5), 0.0)
+    freqs = np.clip(np.rint(2 * (bins + delta)), 0, (1 << FREQ_BITS) - 1)
+    return times.astype(np.int32), freqs.astype(np.int32), anchor[times, bins]
+
+
+def peak_hashes(times, freqs, anchors):
+    # Pair each anchor with the next FAN_OUT later peaks: hash = f1 | f2 | dt (32 bits)
+    anchor_idx = np.flatnonzero(anchors)
+    if not len(anchor_idx):
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint16)
+    first = np.searchsorted(times, times[anchor_idx] + 1)
+    hashes, anchor_times = [], []
+    for k in range(FAN_OUT):
+        j = first + k
+        ok = j < len(times)
+        a, j = anchor_idx[ok], j[ok]
+        dt = times[j] - times[a]
+        ok = dt <= MAX_DT
+        a, j, dt = a[ok], j[ok], dt[ok]
+        f1, f2 = freqs[a].astype(np.uint32), freqs[j].astype(np.uint32)
+        hashes.append((f1 << (FREQ_BITS + DT_BITS)) | (f2 << DT_BITS) | dt.astype(np.uint32))
+        anchor_times.append(times[a])
+    return np.concatenate(hashes), np.concatenate(anchor_times).astype(np.uint16)
+
+
+def fingerprint_file(path):
+    # Worker entry point: (path, mtime, size, hashes, times) or (path, None, None, None, error)
+    try:
+        st = os.stat(path)
+        samples = decode(path)
+        hashes, times = peak_hashes(*spectral_peaks(samples))
+        return path, st.st_mtime, st.st_size, hashes, times
+    except Exception as e:
+        return path, None, None, None, str(e)
+
+
+def _init_worker():
+    # Silent pygame mixer per worker process for non-WAV decoding
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    try:
+        import pygame
+        pygame.mixer.init(frequency=SAMPLE_RATE, size=-16, channels=1)
+    except Exception:
+        pass
+
+
+class FingerprintIndex:
+    def __init__(self, path="fingerprints.npz", workers=None):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.entries = {}  # File path -> (mtime, size, hashes uint32, times uint16)
+        self.stop_event = threading.Event()
+        self.load()
+
+    def load(self):
+        # Cache layout: concatenated hashes/times plus per-file offsets and stat info
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                if "version" not in data.files or int(data["version"]) != CACHE_VERSION:
+                    return
+                paths, mtimes, sizes = data["paths"].tolist(), data["mtimes"], data["sizes"]
+                offsets, hashes, times = data["offsets"], data["hashes"], data["times"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Fingerprint cache load error: {e}")
+            return
+        for i, p in enumerate(paths):
+            lo, hi = offsets[i], offsets[i + 1]
+            self.entries[p] = (float(mtimes[i]), int(sizes[i]), hashes[lo:hi], times[lo:hi])
+
+    def save(self):
+        # Rewrite the cache atomically
+        if not self.entries:
+            return
+        paths = list(self.entries)
+        lengths = [len(self.entries[p][2]) for p in paths]
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path, version=CACHE_VERSION, paths=np.array(paths),
+            mtimes=np.array([self.entries[p][0] for p in paths], dtype=np.float64),
+            sizes=np.array([self.entries[p][1] for p in paths], dtype=np.int64),
+            offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            hashes=np.concatenate([self.entries[p][2] for p in paths]).astype(np.uint32),
+            times=np.concatenate([self.entries[p][3] for p in paths]).astype(np.uint16),
+        )
+        os.replace(tmp_path, self.path)
+
+    def is_current(self, path):
+        # Cached fingerprint still matches the file on disk
+        entry = self.entries.get(path)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        return entry[0] == st.st_mtime and entry[1] == st.st_size
+
+    def update(self, paths, progress=None):
+        # Fingerprint new or changed files on a process pool; returns {path: error} for failures
+        self.stop_event.clear()
+        todo = [p for p in dict.fromkeys(paths) if not self.is_current(p)]
+        errors = {}
+        if todo:
+            ctx = multiprocessing.get_context("spawn")  # The GUI process already owns an SDL mixer
+            pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_init_worker)
+            try:
+                # One future per file so stop() can cancel everything not yet handed to a worker
+                futures = [pool.submit(fingerprint_file, p) for p in todo]
+                for done, future in enumerate(futures, 1):
+                    if self.stop_event.is_set():
+                        break
+                    path, mtime, size, hashes, times = future.result()
+                    if hashes is None:
+                        errors[path] = times
+                    else:
+                        self.entries[path] = (mtime, size, hashes, times)
+                    if progress:
+                        progress(done, len(todo))
+            finally:
+                pool.shutdown(cancel_futures=True)  # Waits only for files already running
+                self.save()
+        return errors
+
+    def stop(self):
+        # Cancel a running update(); completed fingerprints are kept
+        self.stop_event.set()
+
+    def find_duplicates(self, paths, progress=None):
+        # Groups of paths that are the same recording, each with its best pair score
+        self.update(paths, progress)
+        if self.stop_event.is_set():
+            raise InterruptedError("Fingerprinting stopped")  # Files done so far are already cached
+        paths = [p for p in dict.fromkeys(paths) if p in self.entries and len(self.entries[p][2])]
+        pairs = self.match_pairs(paths)
+        # Union-find over matching pairs
+        parent = list(range(len(paths)))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        best = {}
+        for a, b, score in pairs:
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[rb] = ra
+        for a, b, score in pairs:
+            root = find(a)
+            best[root] = max(best.get(root, 0.0), score)
+        groups = {}
+        for i in range(len(paths)):
+            root = find(i)
+            if root in best:
+                groups.setdefault(root, []).append(paths[i])
+        return [(members, best[root]) for root, members in groups.items()]
+
+    def match_pairs(self, paths):
+        # Inverted index as sorted arrays; blocks of files look up their hashes and vote on time offsets
+        if len(paths) < 2:
+            return []
+        n = len(paths)
+        lengths = np.array([len(self.entries[p][2]) for p in paths], dtype=np.int64)
+        offsets = np.r_[0, np.cumsum(lengths)]
+        hashes = np.concatenate([self.entries[p][2] for p in paths])
+        order = np.argsort(hashes, kind="stable").astype(np.int32)  # Stable: files ascend within a list
+        hashes = hashes[order]
+        starts = np.flatnonzero(np.r_[True, hashes[1:] != hashes[:-1]]).astype(np.int32)
+        del hashes
+        sizes = np.diff(np.r_[starts, np.int32(len(order))])
+        list_of = np.repeat(np.arange(len(starts), dtype=np.int32), sizes)  # Sorted posting -> its list
+        times = np.concatenate([self.entries[p][3] for p in paths]).astype(np.int32)[order]
+        files = np.repeat(np.arange(n, dtype=np.int32), lengths)[order]
+        rank = np.empty_like(order)  # File-order posting -> sorted position
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        del order
+        # The cap grows with the library so songs with many copies still get votes, and each vote is
+        # weighted by the hash's IDF so clichés shared across many files count for less
+        lists_by_size = np.bincount(sizes)
+        size = np.arange(len(lists_by_size), dtype=np.int64)
+        affordable = np.flatnonzero(np.cumsum(lists_by_size * size * (size - 1) // 2) <= PAIR_BUDGET)
+        max_posting = max(MIN_POSTING, min(int(n * POSTING_FRACTION), int(affordable[-1])))
+        del lists_by_size, size, affordable
+        idf = np.log(n / sizes).astype(np.float32)
+        idf[sizes > max_posting] = 0.0
+        mass = np.bincount(files, weights=idf[list_of], minlength=n)  # Per-file IDF total
+        # Each posting pairs with the later members of its list (so every file pair is voted on once)
+        ends = (starts + sizes)[list_of]
+        later = np.where((sizes <= max_posting)[list_of], ends - np.arange(len(ends), dtype=np.int32) - 1, 0)
+        del ends
+        per_file = np.bincount(files, weights=later, minlength=n)  # Pairs voted on per first file
+        bounds = np.searchsorted(np.cumsum(per_file), np.arange(PAIR_BATCH, per_file.sum() + PAIR_BATCH, PAIR_BATCH))
+        pairs, lo = [], 0
+        for hi in np.unique(np.r_[np.minimum(bounds + 1, n), n]):
+            pairs += self._vote_block(lo, hi, n, rank[offsets[lo]:offsets[hi]], later, files, times, list_of, idf, mass, lengths)
+            lo = hi
+        return pairs
+
+    def _vote_block(self, lo, hi, n, positions, later, files, times, list_of, idf, mass, lengths):
+        # Votes for file pairs whose first file is in [lo, hi): (file a, file b, score) above the thresholds
+        counts = later[positions]
+        positions = positions[counts > 0]
+        counts = counts[counts > 0]
+        if not len(positions):
+            return []
+        # Expand (posting, later member) pairs without a Python loop
+        anchor = np.repeat(positions, counts)
+        step = np.arange(len(anchor), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        partner = anchor + 1 + step
+        del step
+        fa, fb = files[anchor].astype(np.int64), files[partner].astype(np.int64)
+        keep = fa != fb
+        dt = times[partner] - times[anchor]
+        keys = ((fa - lo) * n + fb) * (2 * DT_OFFSET) + (dt + DT_OFFSET)
+        keys, weights = keys[keep], idf[list_of[anchor[keep]]]
+        del anchor, partner, fa, fb, dt, keep
+        keys, inverse = np.unique(keys, return_inverse=True)
+        votes = np.bincount(inverse, minlength=len(keys))
+        weights = np.bincount(inverse, weights=weights, minlength=len(keys))
+        del inverse
+        # Copies rarely share the frame grid, so peaks drift by a frame: also count the next offset's votes
+        nxt = np.minimum(np.searchsorted(keys, keys + 1), len(keys) - 1)
+        same = keys[nxt] == keys + 1
+        votes = votes + np.where(same, votes[nxt], 0)
+        weights = weights + np.where(same, weights[nxt], 0)
+        # A file pair's score uses its best offset: matched IDF mass over the smaller file's
+        uniq, first = np.unique(keys // (2 * DT_OFFSET), return_index=True)
+        best = np.maximum.reduceat(weights, first)
+        best_votes = np.maximum.reduceat(votes, first)
+        a, b = uniq // n + lo, uniq % n
+        scores = best / np.maximum(np.minimum(mass[a], mass[b]), 1e-9)
+        hit = (best_votes >= MIN_VOTES) & (scores >= DUP_THRESHOLD)
+        return [(int(x), int(y), float(min(s, 1.0))) for x, y, s in zip(a[hit], b[hit], scores[hit])]
@@ -1,18 +1,22 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
-import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 import threading
-import time
+import queue
 import os
 import json
 import pygame
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from spotipy.exceptions import SpotifyException
+from local_matcher import LocalMatcher
+from similarity import FeatureIndex, FEATURES
+from session_manager import SessionManager, INTERACTIVE, POLLING, BACKGROUND
+from fingerprint import FingerprintIndex
 
 class HybridPlayer:
-    def __init__(self, root):
+    def __init__(self, root, client=None):
         self.root = root
         self.root.title("Hybrid Spotify & Local Music Player")
         self.root.geometry("900x800")
@@ -22,9 +26,14 @@ class HybridPlayer:
         self.redirect_uri = "http://localhost:8888/callback"
         self.client_id = None
         self.client_secret = None
-        self.sp = None
+        self.sp = None  # Interactive client; sp_poll/sp_background share its account and rate budget
+        self.sp_poll = None
+        self.sp_background = None
+        self.sessions = None
         self.token_cache = ".cache"
         self.current_track_id = None
+        self.track_data = []  # Current search results, replaced on each search
+        self.feature_index = FeatureIndex("feature_index.npz")  # Audio features of every track seen
         
         # Local player init
         pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
@@ -33,6 +42,11 @@ class HybridPlayer:
         self.local_volume = 0.5
         pygame.mixer.music.set_volume(self.local_volume)
         self.local_is_playing = False
+        self.local_index_path = "local_index.json"
+        self.matcher = None
+        self.match_thread = None
+        self.fingerprints = None  # Loaded on first duplicate scan (fingerprints.npz)
+        self.dup_thread = None
         
         # GUI: Tabs
         self.notebook = ttk.Notebook(self.root)
@@ -50,9 +64,20 @@ class HybridPlayer:
         
         # Status thread (Spotify)
         self.running = False
+        self.status_thread = None
+        self.status_stop = threading.Event()
+        self.poll_interval = 5  # Seconds between playback status polls
         
-        # Get creds
-        self.get_credentials()
+        # Worker threads never call Tk: they queue UI work that the main thread drains
+        self.ui_queue = queue.Queue()
+        self.ui_poll_ms = 50
+        self.ui_after = self.root.after(self.ui_poll_ms, self.drain_ui)
+        
+        # Get creds (a ready client, e.g. the soak-test stand-in, skips the prompt)
+        if client is not None:
+            self.init_spotify(client)
+        else:
+            self.get_credentials()
     
     def setup_spotify_tab(self):
         # Search
@@ -75,7 +100,8 @@ class HybridPlayer:
             ("Play Selected", self.play_selected), ("Pause", self.pause), ("Next", self.next_track),
             ("Prev", self.previous_track), ("Stop", self.stop_playback), ("Shuffle", self.toggle_shuffle),
             ("Repeat", self.toggle_repeat), ("Create Playlist", self.create_playlist),
-            ("Add to Playlist", self.add_to_playlist), ("Export Playlist", self.export_playlist)
+            ("Add to Playlist", self.add_to_playlist), ("Export Playlist", self.export_playlist),
+            ("Queue Similar", self.queue_similar)
         ]:
             ttk.Button(controls_frame, text=text, command=cmd).pack(side="left", padx=5)
         
@@ -98,6 +124,7 @@ class HybridPlayer:
         # Visuals frame
         self.matplot_frame = ttk.Frame(self.spotify_frame)
         self.matplot_frame.pack(pady=10, fill="both", expand=True)
+        self.figure = None
         self.canvas = None
     
     def setup_local_tab(self):
@@ -106,6 +133,8 @@ class HybridPlayer:
         add_frame.pack(pady=10, padx=10, fill="x")
         ttk.Button(add_frame, text="Add Local Files", command=self.add_local_files).pack(side="left")
         ttk.Button(add_frame, text="Clear Playlist", command=self.clear_local_playlist).pack(side="left", padx=5)
+        ttk.Button(add_frame, text="Match to Spotify", command=self.match_local_files).pack(side="left", padx=5)
+        ttk.Button(add_frame, text="Find Duplicates", command=self.find_local_duplicates).pack(side="left", padx=5)
         
         # Listbox: Files
         self.local_listbox = tk.Listbox(self.local_frame, height=10)
@@ -143,13 +172,20 @@ class HybridPlayer:
             messagebox.showerror("Error", "Credentials required!")
             self.root.quit()
     
-    def init_spotify(self):
+    def init_spotify(self, client=None):
         # Init Spotipy client
         try:
-            self.sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
-                client_id=self.client_id, client_secret=self.client_secret,
-                redirect_uri=self.redirect_uri, scope=self.scopes, cache_path=self.token_cache
-            ))
+            self.sessions = SessionManager()
+            if client is not None:
+                self.sessions.add_account("default", client=client)
+            else:
+                self.sessions.add_account("default", auth_manager=SpotifyOAuth(
+                    client_id=self.client_id, client_secret=self.client_secret,
+                    redirect_uri=self.redirect_uri, scope=self.scopes, cache_path=self.token_cache
+                ))
+            self.sp = self.sessions.client("default", INTERACTIVE)
+            self.sp_poll = self.sessions.client("default", POLLING)
+            self.sp_background = self.sessions.client("default", BACKGROUND)
             self.status_var.set("Connected to Spotify")
             self.start_status_update()
         except SpotifyException as e:
@@ -170,9 +206,37 @@ class HybridPlayer:
                 self.listbox.insert(tk.END, display)
                 self.track_data.append(track)
             self.status_var.set(f"Found {len(results['tracks']['items'])} tracks")
+            self.cache_audio_features([track['id'] for track in self.track_data])
         except Exception as e:
             messagebox.showerror("Search Error", str(e))
     
+    def cache_audio_features(self, track_ids):
+        # Fetch features for unseen tracks in one batched call and store them
+        missing = [tid for tid in track_ids if tid and tid not in self.feature_index][:100]
+        if not missing or not self.sp:
+            return
+        try:
+            features = self.sp.audio_features(missing)
+            self.feature_index.add_many((f['id'], f) for f in features if f)
+        except Exception as e:
+            print(f"Features error: {e}")
+    
+    def queue_similar(self):
+        # Queue the nearest tracks (by audio features) to the current one
+        if not self.sp or not self.current_track_id:
+            return
+        self.cache_audio_features([self.current_track_id])
+        similar = self.feature_index.similar(self.current_track_id, k=5)
+        if not similar:
+            self.status_var.set("No similar tracks cached yet - search more")
+            return
+        try:
+            for track_id, _ in similar:
+                self.sp.add_to_queue(f"spotify:track:{track_id}")
+            self.status_var.set(f"Queued {len(similar)} similar tracks")
+        except SpotifyException as e:
+            messagebox.showerror("Error", str(e))
+    
     def play_selected(self, event=None):
         # Play selected track
         selection = self.listbox.curselection()
@@ -238,7 +302,7 @@ class HybridPlayer:
         playlist_id = simpledialog.askstring("Playlist ID", "Enter playlist ID to export:")
         if playlist_id:
             try:
-                results = self.sp.playlist_tracks(playlist_id)
+                results = self.sp_background.playlist_tracks(playlist_id)
                 tracks = [{"name": item["track"]["name"], "artist": item["track"]["artists"][0]["name"], "uri": item["track"]["uri"]} 
                           for item in results["items"] if item["track"]]
                 filename = f"{playlist_id}_export.json"
@@ -328,48 +392,101 @@ class HybridPlayer:
         if not self.sp:
             return
         try:
-            features = self.sp.audio_features(track_id)[0]
+            features = self.fetch_audio_features(track_id)
             if features:
-                fig, ax = plt.subplots(figsize=(8, 4))
-                feats = ['danceability', 'energy', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence']
-                vals = [features[f] for f in feats]
-                ax.bar(feats, vals)
-                ax.set_title(f"Audio Features: {track_id}")
-                ax.set_ylabel("Value (0-1)")
-                plt.xticks(rotation=45)
-                
-                # Embed canvas
-                if self.canvas:
-                    self.canvas.get_tk_widget().destroy()
-                self.canvas = FigureCanvasTkAgg(fig, master=self.matplot_frame)
-                self.canvas.draw()
-                self.canvas.get_tk_widget().pack(fill="both", expand=True)
+                self.plot_audio_features(track_id, features)
         except Exception as e:
             print(f"Vis error: {e}")
     
+    def fetch_audio_features(self, track_id, client=None):
+        # Cached features, or one API call on a miss (no Tk calls, so safe on the status thread)
+        features = self.feature_index.get_features(track_id)
+        if features is None:
+            features = (client or self.sp).audio_features(track_id)[0]
+            if features:
+                self.feature_index.add(track_id, features)
+        return features
+    
+    def plot_audio_features(self, track_id, features):
+        # One figure/canvas for the app's lifetime, redrawn in place (pyplot figures are never freed)
+        if self.canvas is None:
+            self.figure = Figure(figsize=(8, 4))
+            self.canvas = FigureCanvasTkAgg(self.figure, master=self.matplot_frame)
+            self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.figure.clear()
+        ax = self.figure.add_subplot()
+        feats = FEATURES
+        vals = [features[f] for f in feats]
+        ax.bar(feats, vals)
+        ax.set_title(f"Audio Features: {track_id}")
+        ax.set_ylabel("Value (0-1)")
+        ax.tick_params(axis="x", rotation=45)
+        self.figure.tight_layout()
+        self.canvas.draw_idle()
+    
     def start_status_update(self):
         # Start Spotify status thread
         self.running = True
+        self.status_stop.clear()
         self.status_thread = threading.Thread(target=self.update_status, daemon=True)
         self.status_thread.start()
     
+    def stop_status_update(self, timeout=2.0):
+        # Wake the status thread and wait for it to exit (it never blocks on Tk, so the join is short)
+        self.running = False
+        self.status_stop.set()
+        thread, self.status_thread = self.status_thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout)
+    
     def update_status(self):
-        # Update Spotify playback status
+        # Status thread loop; the wait returns early when stop_status_update is called
         while self.running:
-            if self.sp:
-                try:
-                    playback = self.sp.current_playback()
-                    if playback and playback["is_playing"]:
-                        track = playback["item"]
-                        self.status_var.set(f"Playing: {track['name']} - {track['artists'][0]['name']} | {playback['progress_ms']/1000:.0f}s")
-                        if self.current_track_id != track['id']:
-                            self.visualize_audio_features(track['id'])
-                            self.current_track_id = track['id']
-                    elif playback:
-                        self.status_var.set("Paused")
-                except:
-                    pass
-            time.sleep(5)
+            self.poll_status()
+            if self.status_stop.wait(self.poll_interval):
+                break
+    
+    def run_in_ui(self, fn, *args):
+        # Queue fn for the Tk main thread (safe from any thread; no Tk call here)
+        self.ui_queue.put((fn, args))
+    
+    def drain_ui(self):
+        # Main-thread loop: run UI work queued by worker threads, then reschedule
+        while True:
+            try:
+                fn, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"UI update error: {e}")
+        self.ui_after = self.root.after(self.ui_poll_ms, self.drain_ui)
+    
+    def poll_status(self):
+        # Fetch Spotify playback status (network only); the UI is updated on the main thread
+        if not self.sp:
+            return
+        try:
+            playback = self.sp_poll.current_playback()
+            if playback and playback["is_playing"]:
+                track = playback["item"]
+                text = f"Playing: {track['name']} - {track['artists'][0]['name']} | {playback['progress_ms']/1000:.0f}s"
+                features = None
+                if self.current_track_id != track['id']:
+                    features = self.fetch_audio_features(track['id'], client=self.sp_poll)
+                self.run_in_ui(self.show_status, text, track['id'], features)
+            elif playback:
+                self.run_in_ui(self.status_var.set, "Paused")
+        except Exception:
+            pass
+    
+    def show_status(self, text, track_id, features):
+        # Main-thread half of poll_status
+        self.status_var.set(text)
+        if features and self.current_track_id != track_id:
+            self.plot_audio_features(track_id, features)
+        self.current_track_id = track_id
     
     # Local methods
     def add_local_files(self):
@@ -381,6 +498,70 @@ class HybridPlayer:
                 self.local_listbox.insert(tk.END, os.path.basename(file))
         self.local_status_var.set(f"Playlist: {len(self.local_playlist)} files")
     
+    def match_local_files(self):
+        # Link local files to Spotify tracks in the background (resumes from the index)
+        if not self.sp or not self.local_playlist:
+            return
+        if self.match_thread and self.match_thread.is_alive():
+            return  # One run at a time: runs share stop_event and the index file
+        if self.matcher is None:
+            self.matcher = LocalMatcher(self.sp_background, index_path=self.local_index_path, rate=None)
+        paths = list(self.local_playlist)
+        self.match_thread = threading.Thread(target=self.run_local_match, args=(paths,), daemon=True)
+        self.match_thread.start()
+    
+    def run_local_match(self, paths):
+        # Worker for match_local_files
+        status = self.local_status_var.set
+        progress = lambda done, total, matched: self.run_in_ui(status, f"Matching: {done}/{total} ({matched} matched)")
+        try:
+            matched, total = self.matcher.match(paths, progress=progress)
+            self.run_in_ui(status, f"Matched {matched}/{total} new files to Spotify")
+        except Exception as e:
+            self.run_in_ui(status, f"Match error: {e}")
+    
+    def find_local_duplicates(self):
+        # Fingerprint the local playlist in the background and report duplicate recordings
+        if not self.local_playlist:
+            return
+        if self.fingerprints is None:
+            self.fingerprints = FingerprintIndex("fingerprints.npz")
+        if self.dup_thread and self.dup_thread.is_alive():
+            return  # One scan at a time: scans share the entries and the cache file
+        paths = list(self.local_playlist)
+        self.dup_thread = threading.Thread(target=self.run_duplicate_scan, args=(paths,), daemon=True)
+        self.dup_thread.start()
+    
+    def run_duplicate_scan(self, paths):
+        # Worker for find_local_duplicates
+        status = self.local_status_var.set
+        progress = lambda done, total: self.run_in_ui(status, f"Fingerprinting: {done}/{total}")
+        try:
+            groups = self.fingerprints.find_duplicates(paths, progress=progress)
+        except InterruptedError:
+            return  # Stopped on exit
+        except Exception as e:
+            self.run_in_ui(status, f"Duplicate scan error: {e}")
+            return
+        self.run_in_ui(self.show_local_duplicates, groups)
+    
+    def show_local_duplicates(self, groups):
+        # Tag duplicates in the listbox and summarize
+        for index, path in enumerate(self.local_playlist):
+            self.local_listbox.delete(index)
+            self.local_listbox.insert(index, os.path.basename(path))
+        for group, score in groups:
+            for path in group[1:]:
+                if path in self.local_playlist:
+                    index = self.local_playlist.index(path)
+                    self.local_listbox.delete(index)
+                    self.local_listbox.insert(index, f"[dup] {os.path.basename(path)}")
+        extra = sum(len(group) - 1 for group, _ in groups)
+        self.local_status_var.set(f"{len(groups)} duplicate groups ({extra} extra copies)")
+        if groups:
+            summary = "\n\n".join("\n".join(os.path.basename(p) for p in group) + f"\n(match {score:.0%})" for group, score in groups[:10])
+            messagebox.showinfo("Duplicates", summary)
+    
     def clear_local_playlist(self):
         # Clear local playlist
         self.local_playlist = []
@@ -446,7 +627,15 @@ class HybridPlayer:
     
     def on_closing(self):
         # Cleanup on exit
-        self.running = False
+        self.root.after_cancel(self.ui_after)
+        self.stop_status_update()
+        if self.matcher:
+            self.matcher.stop()
+        if self.fingerprints:
+            self.fingerprints.stop()
+        self.feature_index.save()
+        if self.sessions:
+            self.sessions.shutdown(wait=False)
         pygame.mixer.quit()
         if os.path.exists(self.token_cache):
             os.remove(self.token_cache)
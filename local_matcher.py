@@ -0,0 +1,330 @@
+import os
+import re
+import json
+import wave
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, Future
+from difflib import SequenceMatcher
+from spotipy.exceptions import SpotifyException
+
+from rate_limit import TokenBucket
+
+MIN_SCORE = 0.75  # Below this a candidate is not accepted as a match
+DURATION_TOLERANCE = 10.0  # Seconds of drift at which the duration score hits zero
+WEIGHTS = {"title": 0.55, "artist": 0.3, "duration": 0.15}
+TITLE_ONLY_MAX = 0.7  # Cap when only the title can be compared (below MIN_SCORE: never accepted alone)
+# Leading track number ("01", "A1") and what follows it: "." / ")" (group 2), " - " (group 3) or plain space
+TRACK_NO = re.compile(r"^\s*(\d{1,3}|[a-d]\d{1,2})(?:\s*([.)])|\s*(-)|)\s+", re.IGNORECASE)
+SEPARATOR = re.compile(r"\s+[-–—]\s+")
+BRACKETS = re.compile(r"[\(\[\{].*?[\)\]\}]")
+FEAT = re.compile(r"\s(?:feat|ft|featuring)\.?\s.*$")
+NON_WORD = re.compile(r"[^\w\s]+")
+
+
+def normalize(text):
+    # Lowercase, drop accents, bracketed tags ("(Remastered)", "[Live]"), "feat." tails and punctuation
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = BRACKETS.sub(" ", text)
+    text = FEAT.sub(" ", text)
+    text = NON_WORD.sub(" ", text).replace("_", " ")
+    return " ".join(text.split())
+
+
+def similarity(a, b):
+    # Fuzzy ratio with cheap upper-bound checks before the full comparison
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    if matcher.real_quick_ratio() < 0.5 or matcher.quick_ratio() < 0.5:
+        return 0.0
+    return matcher.ratio()
+
+
+def _decode_text_frame(data):
+    # ID3v2 text frame: first byte is the encoding
+    encodings = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}
+    if not data:
+        return ""
+    text = data[1:].decode(encodings.get(data[0], "latin-1"), errors="ignore")
+    return text.split("\x00")[0].strip()
+
+
+def read_id3v2(f):
+    # Minimal ID3v2.3/2.4 reader for title, artist, album and length
+    tags = {}
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return tags
+    major, flags = header[3], header[5]
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    if major not in (3, 4) or flags & 0x80:  # Skip v2.2 and unsynchronised tags
+        return tags
+    body = f.read(size)
+    if flags & 0x40:  # Extended header
+        ext = body[:4]
+        ext_size = ((ext[0] << 21) | (ext[1] << 14) | (ext[2] << 7) | ext[3]) if major == 4 else int.from_bytes(ext, "big") + 4
+        body = body[ext_size:]
+    wanted = {b"TIT2": "title", b"TPE1": "artist", b"TALB": "album", b"TLEN": "length"}
+    pos = 0
+    while pos + 10 <= len(body) and body[pos:pos + 4].strip(b"\x00"):
+        frame_id = body[pos:pos + 4]
+        raw = body[pos + 4:pos + 8]
+        if major == 4:
+            frame_size = (raw[0] << 21) | (raw[1] << 14) | (raw[2] << 7) | raw[3]
+        else:
+            frame_size = int.from_bytes(raw, "big")
+        data = body[pos + 10:pos + 10 + frame_size]
+        if frame_id in wanted:
+            tags[wanted[frame_id]] = _decode_text_frame(data)
+        pos += 10 + frame_size
+    return tags
+
+
+def read_id3v1(f):
+    # ID3v1 trailer: fixed 30-byte title/artist/album fields
+    try:
+        f.seek(-128, os.SEEK_END)
+    except OSError:
+        return {}
+    block = f.read(128)
+    if block[:3] != b"TAG":
+        return {}
+    field = lambda raw: raw.split(b"\x00")[0].decode("latin-1", errors="ignore").strip()
+    return {"title": field(block[3:33]), "artist": field(block[33:63]), "album": field(block[63:93])}
+
+
+def read_tags(path):
+    # Tags from the file itself (ID3 for mp3), empty dict if none are readable
+    tags = {}
+    try:
+        with open(path, "rb") as f:
+            tags = read_id3v2(f)
+            if not tags.get("title"):
+                f.seek(0)
+                tags = {**read_id3v1(f), **{k: v for k, v in tags.items() if v}}
+    except (OSError, IndexError, ValueError):
+        pass
+    return {k: v for k, v in tags.items() if v}
+
+
+def read_duration(path, tags=None):
+    # Track length in seconds: ID3 TLEN or the WAV header; None if unknown
+    if tags and tags.get("length", "").isdigit():
+        return int(tags["length"]) / 1000.0
+    if path.lower().endswith(".wav"):
+        try:
+            with wave.open(path, "rb") as w:
+                return w.getnframes() / float(w.getframerate())
+        except (OSError, wave.Error, EOFError):
+            pass
+    return None
+
+
+def parse_filename(path):
+    # "01 - Artist - Title.mp3" / "Artist - Title.mp3" / "Title.mp3"
+    stem = os.path.splitext(os.path.basename(path))[0].replace("_", " ")
+    split = lambda text: [p.strip() for p in SEPARATOR.split(text) if p.strip()]
+    m = TRACK_NO.match(stem)
+    if m:
+        rest = stem[m.end():]
+        # "50 Cent - ..." / "A1 - Title" keep their first word: only strip a number that is
+        # zero-padded, followed by "." or ")", or followed by " - " with artist and title after it
+        if m.group(2) or (m.group(1).startswith("0") and len(m.group(1)) > 1) or (m.group(3) and len(split(rest)) >= 2):
+            stem = rest
+    parts = split(stem)
+    if len(parts) >= 2:
+        return {"artist": parts[0], "title": " - ".join(parts[1:])}
+    return {"title": stem.strip()}
+
+
+def describe_file(path):
+    # Everything the matcher knows about a local file before searching
+    info = parse_filename(path)
+    tags = read_tags(path)
+    info.update({k: tags[k] for k in ("title", "artist", "album") if k in tags})
+    info["duration"] = read_duration(path, tags)
+    return info
+
+
+def build_queries(info):
+    # Strictest query first, falling back to free text
+    title, artist = normalize(info.get("title")), normalize(info.get("artist"))
+    queries = []
+    if title and artist:
+        queries.append(f'track:"{title}" artist:"{artist}"')
+        queries.append(f"{artist} {title}")
+    elif title:
+        queries.append(title)
+    return queries
+
+
+class LocalMatcher:
+    def __init__(self, sp, index_path="local_index.json", rate=10.0, burst=20, workers=8, bucket=None):
+        self.sp = sp
+        self.index_path = index_path
+        # rate=None: no local budget or 429 retries, e.g. when sp is already a SessionManager client
+        self.bucket = bucket or (TokenBucket(rate, burst) if rate else None)
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.inflight = {}  # Normalized query -> Future while a search is running
+        self.stop_event = threading.Event()
+        self.tracks = {}  # Local path -> match record
+        self.queries = {}  # Normalized query -> slim candidate list (memo)
+        self.load_index()
+
+    def load_index(self):
+        # Load previous matches and query memo so interrupted runs resume
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            self.tracks = data.get("tracks", {})
+            self.queries = data.get("queries", {})
+        except (OSError, ValueError) as e:
+            print(f"Index load error: {e}")
+
+    def save_index(self):
+        # Atomic write: a crash mid-save leaves the previous index intact
+        with self.lock:
+            data = {"tracks": dict(self.tracks), "queries": dict(self.queries)}
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.index_path)
+
+    def get_match(self, path):
+        # Stored match for a local file, or None
+        record = self.tracks.get(path)
+        return record if record and record.get("uri") else None
+
+    def is_current(self, path, record):
+        # A stored record is reusable if the file hasn't changed since it was matched
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True  # Missing files keep their last result
+        return record.get("mtime") == st.st_mtime and record.get("size") == st.st_size
+
+    def search(self, query):
+        # Memoized, de-duplicated, rate-limited Spotify search
+        with self.lock:
+            if query in self.queries:
+                return self.queries[query]
+            future = self.inflight.get(query)
+            owner = future is None
+            if owner:
+                future = self.inflight[query] = Future()
+        if not owner:
+            return future.result()
+        try:
+            candidates = self._search_remote(query)
+            with self.lock:
+                self.queries[query] = candidates
+            future.set_result(candidates)
+            return candidates
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(query, None)
+
+    def _search_remote(self, query, attempts=3):
+        # One search call within the shared budget, honouring 429 Retry-After. Without a local
+        # bucket the client owns rate limiting and retries, so a 429 is raised as is
+        attempts = attempts if self.bucket else 1
+        for attempt in range(attempts):
+            if self.stop_event.is_set() or (self.bucket and not self.bucket.acquire(stop_event=self.stop_event)):
+                raise InterruptedError("Matching stopped")
+            try:
+                results = self.sp.search(q=query, type="track", limit=10)
+                break
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == attempts - 1:
+                    raise
+                self.bucket.penalize(float((e.headers or {}).get("Retry-After", 1)))
+        return [{
+            "id": t["id"], "uri": t["uri"], "name": t["name"],
+            "artists": [a["name"] for a in t["artists"]], "duration_ms": t["duration_ms"]
+        } for t in results["tracks"]["items"] if t]
+
+    def score(self, info, candidate):
+        # Weighted fuzzy title/artist similarity plus duration closeness
+        parts = {"title": similarity(normalize(info.get("title")), normalize(candidate["name"]))}
+        if info.get("artist"):
+            artist = normalize(info["artist"])
+            parts["artist"] = max((similarity(artist, normalize(a)) for a in candidate["artists"]), default=0.0)
+        if info.get("duration"):
+            drift = abs(info["duration"] - candidate["duration_ms"] / 1000.0)
+            parts["duration"] = max(0.0, 1.0 - drift / DURATION_TOLERANCE)
+        total = sum(WEIGHTS[k] for k in parts)
+        score = sum(WEIGHTS[k] * v for k, v in parts.items()) / total
+        return score if len(parts) > 1 else min(score, TITLE_ONLY_MAX)
+
+    def match_file(self, path):
+        # Best candidate across the file's queries; stops early on a confident hit
+        if self.stop_event.is_set():
+            raise InterruptedError("Matching stopped")  # Queued files after stop() don't even read the file
+        info = describe_file(path)
+        best, best_score, used_query = None, 0.0, None
+        for query in build_queries(info):
+            for candidate in self.search(query):
+                s = self.score(info, candidate)
+                if s > best_score:
+                    best, best_score, used_query = candidate, s, query
+            if best_score >= MIN_SCORE:
+                break
+        try:
+            st = os.stat(path)
+            mtime, size = st.st_mtime, st.st_size
+        except OSError:
+            mtime, size = None, None
+        record = {"mtime": mtime, "size": size, "query": used_query, "score": round(best_score, 3), "uri": None}
+        if best and best_score >= MIN_SCORE:
+            record.update({"uri": best["uri"], "id": best["id"], "name": best["name"], "artist": best["artists"][0] if best["artists"] else ""})
+        return record
+
+    def match(self, paths, progress=None, retry_unmatched=False, checkpoint_every=200):
+        # Match many files concurrently; already-indexed unchanged files are skipped
+        self.stop_event.clear()
+        todo = []
+        for path in paths:
+            record = self.tracks.get(path)
+            if record and self.is_current(path, record) and (record.get("uri") or not retry_unmatched):
+                continue
+            todo.append(path)
+        done, matched = 0, 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self.match_file, p): p for p in todo}
+                for future in futures:
+                    path = futures[future]
+                    try:
+                        record = future.result()
+                    except InterruptedError:
+                        continue
+                    except Exception as e:
+                        print(f"Match error ({os.path.basename(path)}): {e}")
+                        continue
+                    with self.lock:
+                        self.tracks[path] = record
+                    done += 1
+                    matched += bool(record["uri"])
+                    if done % checkpoint_every == 0:
+                        self.save_index()
+                    if progress:
+                        progress(done, len(todo), matched)
+        finally:
+            self.save_index()
+        return matched, len(todo)
+
+    def stop(self):
+        # Cancel a running match(); completed results are kept
+        self.stop_event.set()
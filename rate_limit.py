@@ -0,0 +1,51 @@
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate=10.0, capacity=20):
+        # rate: tokens refilled per second; capacity: max burst size
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        # Top up tokens for the time elapsed since the last call (lock held)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        # Take tokens if available right now, never block
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1):
+        # Seconds until `tokens` would be available
+        with self.lock:
+            self._refill()
+            return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def acquire(self, tokens=1, stop_event=None):
+        # Block until tokens are available; returns False if stop_event was set first
+        while True:
+            if self.try_acquire(tokens):
+                return True
+            delay = self.wait_time(tokens)
+            if stop_event is not None:
+                if stop_event.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+    def penalize(self, seconds):
+        # Drain the bucket so nobody sends for `seconds` (e.g. after a 429 Retry-After)
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
@@ -0,0 +1,243 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+import spotipy
+from spotipy.exceptions import SpotifyException
+
+from rate_limit import TokenBucket
+
+# Priority classes, highest first: playback commands, status polling, bulk work (export, matching)
+INTERACTIVE, POLLING, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", POLLING: "polling", BACKGROUND: "background"}
+THROUGHPUT_WINDOW = 60.0  # Seconds of history used for calls/s
+MAX_429_RETRIES = 3
+# spotipy must not retry on its own: urllib3 sleeps out any 429 with Retry-After whenever retries > 0,
+# which would hold a worker and bypass the shared budget. 429s surface to _run instead.
+CLIENT_OPTIONS = {"retries": 0, "status_retries": 0, "status_forcelist": (500, 502, 503, 504)}
+
+
+class Job:
+    def __init__(self, account, method, args, kwargs, priority):
+        self.account = account
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class Session:
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.queues = {p: deque() for p in PRIORITY_NAMES}
+        self.completed = 0
+        self.failed = 0
+        self.delay_total = 0.0
+        self.delay_max = 0.0
+        self.finished = deque()  # Completion timestamps within THROUGHPUT_WINDOW
+        self.delays = {p: 0.0 for p in PRIORITY_NAMES}  # Total queueing delay per class
+        self.counts = {p: 0 for p in PRIORITY_NAMES}  # Dispatched calls per class
+
+    def pending(self):
+        return sum(len(q) for q in self.queues.values())
+
+
+class SessionClient:
+    # Drop-in for a spotipy.Spotify: every method call is scheduled through the manager
+    def __init__(self, manager, account, priority):
+        self._manager = manager
+        self._account = account
+        self._priority = priority
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self._manager.call(self._account, method, *args, priority=self._priority, **kwargs)
+
+
+class SessionManager:
+    def __init__(self, rate=10.0, burst=20, workers=4):
+        self.bucket = TokenBucket(rate, burst)  # One budget shared by every account (app-level limit)
+        self.sessions = {}
+        self.order = []  # Account names in round-robin order
+        self.cursor = {p: 0 for p in PRIORITY_NAMES}  # Next account to serve per class
+        self.cond = threading.Condition()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.Semaphore(workers)  # Free workers; a job is only picked once one is free
+        self.running = True
+        self.started = time.monotonic()
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self.dispatcher.start()
+
+    def add_account(self, name, auth_manager=None, client=None):
+        # Register an account by auth manager (e.g. SpotifyOAuth with its own cache_path) or ready client
+        if client is None:
+            client = spotipy.Spotify(auth_manager=auth_manager, **CLIENT_OPTIONS)
+        with self.cond:
+            if name in self.sessions:
+                raise ValueError(f"Account already registered: {name}")
+            self.sessions[name] = Session(name, client)
+            self.order.append(name)
+        return self.client(name)
+
+    def remove_account(self, name):
+        # Unregister an account, failing anything still queued for it
+        with self.cond:
+            session = self.sessions.pop(name)
+            self.order.remove(name)
+            jobs = [job for q in session.queues.values() for job in q]
+        for job in jobs:
+            job.future.set_exception(KeyError(f"Account removed: {name}"))
+
+    def client(self, account, priority=INTERACTIVE):
+        # spotipy-like client bound to one account and priority class
+        return SessionClient(self, account, priority)
+
+    def submit(self, account, method, *args, priority=INTERACTIVE, **kwargs):
+        # Queue one API call; returns a Future with the result
+        job = Job(account, method, args, kwargs, priority)
+        with self.cond:
+            if not self.running:
+                raise RuntimeError("Session manager is shut down")
+            self.sessions[account].queues[priority].append(job)
+            self.cond.notify()
+        return job.future
+
+    def call(self, account, method, *args, priority=INTERACTIVE, **kwargs):
+        # Blocking submit
+        return self.submit(account, method, *args, priority=priority, **kwargs).result()
+
+    def _has_work(self):
+        return any(s.pending() for s in self.sessions.values())
+
+    def _next_job(self):
+        # Highest non-empty class first; round-robin across accounts within it (lock held).
+        # Jobs cancelled before their first attempt are dropped here: no call, no token, no stats
+        for priority in PRIORITY_NAMES:
+            n = len(self.order)
+            for step in range(n):
+                i = (self.cursor[priority] + step) % n
+                queue = self.sessions[self.order[i]].queues[priority]
+                while queue:
+                    job = queue.popleft()
+                    if job.attempts or job.future.set_running_or_notify_cancel():
+                        self.cursor[priority] = (i + 1) % n
+                        return job
+        return None
+
+    def _dispatch_loop(self):
+        # Wait for work, a free worker and a token, then pick the job: priority is decided at send time
+        while True:
+            with self.cond:
+                while self.running and not self._has_work():
+                    self.cond.wait()
+                if not self.running:
+                    return
+            while not self.slots.acquire(timeout=0.1):
+                if not self.running:
+                    return
+            self.bucket.acquire()
+            with self.cond:
+                job = self._next_job() if self.running else None
+                if job is not None:
+                    self.pool.submit(self._run, job)
+            if job is None:
+                self.slots.release()
+                if not self.running:
+                    return
+
+    def _run(self, job):
+        # Worker entry point: always frees its slot for the dispatcher
+        try:
+            self._execute(job)
+        finally:
+            self.slots.release()
+
+    def _execute(self, job):
+        # Execute one call and record stats; a 429 drains the bucket and requeues the job
+        session = self.sessions.get(job.account)
+        if session is None:
+            job.future.set_exception(KeyError(f"Account removed: {job.account}"))
+            return
+        start = time.monotonic()
+        delay = start - job.enqueued
+        job.attempts += 1
+        try:
+            result = getattr(session.client, job.method)(*job.args, **job.kwargs)
+        except SpotifyException as e:
+            if e.http_status == 429 and job.attempts < MAX_429_RETRIES:
+                self.bucket.penalize(float((e.headers or {}).get("Retry-After", 1)))
+                with self.cond:
+                    session.queues[job.priority].appendleft(job)
+                    self.cond.notify()
+                return
+            self._record(session, job, delay, ok=False)
+            job.future.set_exception(e)
+        except Exception as e:
+            self._record(session, job, delay, ok=False)
+            job.future.set_exception(e)
+        else:
+            self._record(session, job, delay, ok=True)
+            job.future.set_result(result)
+
+    def _record(self, session, job, delay, ok):
+        # Per-account counters (delay is measured from first enqueue, including 429 retries)
+        now = time.monotonic()
+        with self.cond:
+            if ok:
+                session.completed += 1
+            else:
+                session.failed += 1
+            session.delay_total += delay
+            session.delay_max = max(session.delay_max, delay)
+            session.delays[job.priority] += delay
+            session.counts[job.priority] += 1
+            session.finished.append(now)
+            while session.finished and now - session.finished[0] > THROUGHPUT_WINDOW:
+                session.finished.popleft()
+
+    def stats(self):
+        # Per-account throughput (calls/s over the last minute) and queueing delay (seconds)
+        now = time.monotonic()
+        window = min(THROUGHPUT_WINDOW, max(now - self.started, 1e-9))
+        report = {}
+        with self.cond:
+            for name in self.order:
+                s = self.sessions[name]
+                calls = s.completed + s.failed
+                recent = sum(1 for t in s.finished if now - t <= THROUGHPUT_WINDOW)
+                report[name] = {
+                    "completed": s.completed,
+                    "failed": s.failed,
+                    "queued": {PRIORITY_NAMES[p]: len(q) for p, q in s.queues.items()},
+                    "throughput": recent / window,
+                    "mean_delay": s.delay_total / calls if calls else 0.0,
+                    "max_delay": s.delay_max,
+                    "mean_delay_by_class": {PRIORITY_NAMES[p]: s.delays[p] / s.counts[p] for p in PRIORITY_NAMES if s.counts[p]},
+                }
+        return report
+
+    def report(self):
+        # Human-readable stats table
+        lines = [f"{'account':<16}{'done':>7}{'fail':>6}{'queued':>8}{'calls/s':>9}{'mean ms':>9}{'max ms':>9}"]
+        for name, s in self.stats().items():
+            lines.append(f"{name:<16}{s['completed']:>7}{s['failed']:>6}{sum(s['queued'].values()):>8}"
+                         f"{s['throughput']:>9.2f}{s['mean_delay'] * 1000:>9.1f}{s['max_delay'] * 1000:>9.1f}")
+        return "\n".join(lines)
+
+    def shutdown(self, wait=True):
+        # Stop dispatching and cancel queued calls; in-flight calls finish if wait
+        with self.cond:
+            self.running = False
+            jobs = [job for s in self.sessions.values() for q in s.queues.values() for job in q]
+            for s in self.sessions.values():
+                for q in s.queues.values():
+                    q.clear()
+            self.cond.notify_all()
+        for job in jobs:
+            job.future.cancel()
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,280 @@
+import os
+import threading
+import numpy as np
+
+FEATURES = ['danceability', 'energy', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence']
+APPROX_THRESHOLD = 50_000  # Switch from brute force to the IVF index past this many vectors
+TRAIN_SAMPLE = 50_000  # Rows used to train the coarse centroids
+QUERY_CHUNK = 262_144  # Rows per block in brute-force scans (bounds temporary memory)
+
+
+def feature_vector(features):
+    # Spotify audio_features dict -> float32 vector in FEATURES order
+    return np.array([features.get(f) or 0.0 for f in FEATURES], dtype=np.float32)
+
+
+class FeatureIndex:
+    def __init__(self, path="feature_index.npz", approx_threshold=APPROX_THRESHOLD, n_probe=8, capacity=1024):
+        self.path = path
+        self.approx_threshold = approx_threshold
+        self.n_probe = n_probe
+        self.vectors = np.zeros((capacity, len(FEATURES)), dtype=np.float32)  # Contiguous, rows [0, count) used
+        self.norms = np.zeros(capacity, dtype=np.float32)  # Squared L2 norm per row
+        self.count = 0
+        self.ids = []
+        self.rows = {}  # Track ID -> row
+        # IVF state: centroids, nearest centroid per row, row order grouped by list (rows < indexed_count),
+        # list boundaries, and the row count the centroids were trained on
+        self.centroids = None
+        self.assign = np.zeros(capacity, dtype=np.int32)
+        self.list_order = None
+        self.list_offsets = None
+        self.indexed_count = 0
+        self.trained_count = 0
+        self.building = False  # A background build is running
+        self.lock = threading.RLock()  # Status thread adds while the GUI queries
+        self.load()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, track_id):
+        return track_id in self.rows
+
+    def _grow(self, needed):
+        # Double capacity (amortized O(1) appends, matrix stays contiguous)
+        capacity = len(self.vectors)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        vectors = np.zeros((capacity, len(FEATURES)), dtype=np.float32)
+        vectors[:self.count] = self.vectors[:self.count]
+        norms = np.zeros(capacity, dtype=np.float32)
+        norms[:self.count] = self.norms[:self.count]
+        assign = np.zeros(capacity, dtype=np.int32)
+        assign[:self.count] = self.assign[:self.count]
+        self.vectors, self.norms, self.assign = vectors, norms, assign
+
+    def add(self, track_id, features):
+        # Store or overwrite one track's features
+        self.add_many([(track_id, features)])
+
+    def add_many(self, items):
+        # items: (track_id, audio_features dict or vector) pairs
+        items = [(tid, f) for tid, f in items if tid and f is not None]
+        if not items:
+            return
+        with self.lock:
+            self._grow(self.count + len(items))
+            first_new = self.count
+            for track_id, features in items:
+                vec = features if isinstance(features, np.ndarray) else feature_vector(features)
+                row = self.rows.get(track_id)
+                if row is None:
+                    row = self.count
+                    self.rows[track_id] = row
+                    self.ids.append(track_id)
+                    self.count += 1
+                self.vectors[row] = vec
+                self.norms[row] = float(vec @ vec)
+            if self.centroids is not None and self.count > first_new:
+                # New rows join the nearest existing list right away (searched as the tail until compaction)
+                self.assign[first_new:self.count] = self._assign(self.vectors[first_new:self.count], self.centroids)
+
+    def get(self, track_id):
+        # Stored vector for a track, or None
+        with self.lock:
+            row = self.rows.get(track_id)
+            return None if row is None else self.vectors[row].copy()
+
+    def get_features(self, track_id):
+        # Stored vector as an audio_features-style dict, or None
+        vec = self.get(track_id)
+        return None if vec is None else dict(zip(FEATURES, vec.tolist()))
+
+    def _distances(self, rows, queries):
+        # Squared L2 distances, rows x queries, via |x|^2 - 2x.q + |q|^2 (rows: slice or index array)
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        d = self.norms[rows][:, None] - 2.0 * (self.vectors[rows] @ queries.T) + q_norms[None, :]
+        return np.maximum(d, 0.0, out=d)
+
+    def _top_k(self, dists, k):
+        # Positions and values of the k smallest entries per column, sorted
+        k = min(k, dists.shape[0])
+        part = np.argpartition(dists, k - 1, axis=0)[:k]
+        part_d = np.take_along_axis(dists, part, axis=0)
+        order = np.argsort(part_d, axis=0)
+        return np.take_along_axis(part, order, axis=0), np.take_along_axis(part_d, order, axis=0)
+
+    def _search_exact(self, queries, k):
+        # Brute force over contiguous row blocks, merging the per-block top-k
+        block_rows, block_d = [], []
+        for start in range(0, self.count, QUERY_CHUNK):
+            pos, d = self._top_k(self._distances(slice(start, min(start + QUERY_CHUNK, self.count)), queries), k)
+            block_rows.append(pos + start)
+            block_d.append(d)
+        if len(block_rows) == 1:
+            return block_rows[0], block_d[0]
+        all_rows, all_d = np.vstack(block_rows), np.vstack(block_d)
+        pos, d = self._top_k(all_d, k)
+        return np.take_along_axis(all_rows, pos, axis=0), d
+
+    def _search_ivf(self, queries, k):
+        # Probe the n_probe nearest lists per query; rows added since the last compaction are
+        # filtered from the tail by their incremental assignment
+        c_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        c_dists = c_norms[:, None] - 2.0 * (self.centroids @ queries.T)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(c_dists, n_probe - 1, axis=0)[:n_probe]
+        tail = np.arange(self.indexed_count, self.count)
+        tail_assign = self.assign[self.indexed_count:self.count]
+        rows_out = np.full((k, len(queries)), -1, dtype=np.int64)
+        d_out = np.full((k, len(queries)), np.inf, dtype=np.float32)
+        for qi in range(len(queries)):
+            lists = probes[:, qi]
+            parts = [self.list_order[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists]
+            rows = np.concatenate(parts + [tail[np.isin(tail_assign, lists)]])
+            if not len(rows):
+                continue
+            pos, d = self._top_k(self._distances(rows, queries[qi:qi + 1]), k)
+            rows_out[:len(pos), qi], d_out[:len(d), qi] = rows[pos[:, 0]], d[:, 0]
+        return rows_out, d_out
+
+    def _train(self, data, n_lists=None, iterations=10, seed=0):
+        # k-means on a sample of data -> centroids
+        n_lists = n_lists or max(1, int(np.sqrt(len(data))))
+        rng = np.random.default_rng(seed)
+        sample = data[rng.choice(len(data), min(len(data), TRAIN_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), min(n_lists, len(sample)), replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=len(centroids))
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        return centroids
+
+    def build(self, retrain=True, n_lists=None):
+        # Retrain centroids on a snapshot (or just regroup rows by their current list), then swap in
+        with self.lock:
+            n = self.count
+            if n == 0:
+                return
+            retrain = retrain or self.centroids is None
+            data = self.vectors[:n].copy() if retrain else None
+            assign = None if retrain else self.assign[:n].copy()
+        centroids = None
+        if retrain:
+            # The slow part (k-means + assigning every row) runs without the lock
+            centroids = self._train(data, n_lists)
+            assign = self._assign(data, centroids).astype(np.int32)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[order], np.arange((len(centroids) if retrain else len(self.centroids)) + 1))
+        with self.lock:
+            if retrain:
+                self.centroids = centroids
+                self.trained_count = n
+                self.assign[:n] = assign
+                if self.count > n:  # Rows added during the build
+                    self.assign[n:self.count] = self._assign(self.vectors[n:self.count], centroids)
+            self.list_order = order
+            self.list_offsets = offsets
+            self.indexed_count = n
+
+    def _build_in_background(self, retrain):
+        # Start one background build unless one is already running (lock held)
+        if self.building:
+            return
+        self.building = True
+        def run():
+            try:
+                self.build(retrain=retrain)
+            except Exception as e:
+                print(f"Feature index build error: {e}")
+            finally:
+                self.building = False
+        threading.Thread(target=run, daemon=True).start()
+
+    def _assign(self, data, centroids):
+        # Nearest centroid per row, chunked so the distance block stays ~64 MB
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+        out = np.empty(len(data), dtype=np.int64)
+        chunk = max(1, (1 << 24) // len(centroids))
+        for start in range(0, len(data), chunk):
+            block = data[start:start + chunk]
+            out[start:start + len(block)] = np.argmin(c_norms[None, :] - 2.0 * (block @ centroids.T), axis=1)
+        return out
+
+    def _ensure_index(self):
+        # IVF usable? Past the threshold the index is built off-thread (exact search meanwhile);
+        # retrain when the data doubles, regroup when the tail passes 10% (lock held)
+        if self.count < self.approx_threshold:
+            return False
+        if self.centroids is None:
+            self._build_in_background(retrain=True)
+            return False
+        if self.count > 2 * self.trained_count:
+            self._build_in_background(retrain=True)
+        elif self.count - self.indexed_count > 0.1 * self.indexed_count:
+            self._build_in_background(retrain=False)
+        return True
+
+    def query_many(self, queries, k=10):
+        # Batched k-NN: queries (m x 7) -> (k x m) row indices and squared distances
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        with self.lock:
+            if self.count == 0:
+                return np.empty((0, len(queries)), dtype=np.int64), np.empty((0, len(queries)), dtype=np.float32)
+            if self._ensure_index():
+                return self._search_ivf(queries, k)
+            return self._search_exact(queries, k)
+
+    def similar(self, track_id, k=10, exclude=()):
+        # Nearest stored tracks to track_id as (track_id, distance) pairs, excluding itself
+        vec = self.get(track_id)
+        if vec is None:
+            return []
+        skip = set(exclude) | {track_id}
+        rows, dists = self.query_many(vec, k + len(skip))
+        ids = self.ids  # Append-only, so rows returned above stay valid
+        results = []
+        for row, dist in zip(rows[:, 0], dists[:, 0]):
+            if row < 0 or ids[row] in skip:
+                continue
+            results.append((ids[row], float(np.sqrt(dist))))
+            if len(results) == k:
+                break
+        return results
+
+    def save(self):
+        # Persist vectors and IDs (the IVF index is rebuilt on demand)
+        with self.lock:
+            if self.count == 0:
+                return
+            vectors, ids = self.vectors[:self.count].copy(), np.array(self.ids)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, vectors=vectors, ids=ids)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        # Restore a saved index, if any
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                vectors, ids = data["vectors"], data["ids"].tolist()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Feature index load error: {e}")
+            return
+        # Bulk copy: one matrix write and one dict build instead of a per-row add
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            self.count = 0
+            self._grow(len(ids))
+            self.vectors[:len(ids)] = vectors
+            self.norms[:len(ids)] = np.einsum("ij,ij->i", vectors, vectors)
+            self.ids = ids
+            self.rows = {track_id: row for row, track_id in enumerate(ids)}
+            self.count = len(ids)
@@ -0,0 +1,380 @@
+import os
+import sys
+import json
+import math
+import time
+import wave
+import zlib
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from array import array
+from collections import deque
+import tkinter as tk
+
+from similarity import FEATURES
+
+OPERATIONS = ("search", "play", "poll", "chart", "local_switch")
+# Metric -> (absolute floor, relative-to-start threshold) a projected growth must exceed to be flagged
+TREND_LIMITS = {
+    "rss": (8 * 1024 * 1024, 0.10),
+    "traced": (4 * 1024 * 1024, 0.10),
+    "threads": (2, 0.0),
+    "figures": (1, 0.0),
+}
+LATENCY_LIMIT = (0.005, 0.5)  # p95 must grow by >5 ms and >50% to be flagged
+RISING_FRACTION = 0.6  # Share of sample-to-sample steps that must rise for a flag (filters noise)
+
+
+class FakeSpotify:
+    # Local stand-in for the spotipy calls HybridPlayer makes: deterministic catalog, simulated latency
+    def __init__(self, catalog_size=5000, latency=0.005, track_change=0.2, seed=0):
+        self.catalog_size = catalog_size
+        self.latency = latency
+        self.track_change = track_change  # Chance per poll that playback moved to another track
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.current = None
+        self.is_playing = False
+        self.started = time.monotonic()
+        self.queue = deque(maxlen=100)
+        self.calls = 0
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _track(self, n):
+        track_id = f"soak{n:07d}"
+        return {
+            "id": track_id, "uri": f"spotify:track:{track_id}", "name": f"Track {n}",
+            "artists": [{"name": f"Artist {n % 500}"}], "duration_ms": 120000 + (n * 7919) % 180000,
+            "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+        }
+
+    def _features(self, track_id):
+        rng = random.Random(track_id)
+        return {"id": track_id, **{f: rng.random() for f in FEATURES}}
+
+    def search(self, q, type="track", limit=10, **kwargs):
+        self._call()
+        base = zlib.crc32(q.encode()) % self.catalog_size
+        return {"tracks": {"items": [self._track((base + i) % self.catalog_size) for i in range(limit)]}}
+
+    def audio_features(self, tracks):
+        self._call()
+        ids = [tracks] if isinstance(tracks, str) else list(tracks)
+        return [self._features(track_id) for track_id in ids]
+
+    def start_playback(self, uris=None, **kwargs):
+        self._call()
+        with self.lock:
+            if uris:
+                self.current = int(uris[0].rsplit("soak", 1)[1])
+            self.is_playing = True
+            self.started = time.monotonic()
+
+    def current_playback(self):
+        self._call()
+        with self.lock:
+            if self.current is None:
+                return None
+            if self.is_playing and self.rng.random() < self.track_change:
+                self.current = self.rng.randrange(self.catalog_size)
+                self.started = time.monotonic()
+            progress = int((time.monotonic() - self.started) * 1000)
+            return {"is_playing": self.is_playing, "progress_ms": progress, "item": self._track(self.current)}
+
+    def pause_playback(self, **kwargs):
+        self._call()
+        with self.lock:
+            self.is_playing = False
+
+    def add_to_queue(self, uri, **kwargs):
+        self._call()
+        self.queue.append(uri)
+
+    def next_track(self, **kwargs):
+        self._call()
+        with self.lock:
+            self.current = self.rng.randrange(self.catalog_size)
+
+    def previous_track(self, **kwargs):
+        self.next_track()
+
+    def volume(self, volume_percent, **kwargs):
+        self._call()
+
+    def seek_track_position(self, position_ms, **kwargs):
+        self._call()
+
+
+def write_tone(path, freq, seconds=2.0, rate=22050):
+    # Short sine WAV used as a local track
+    n = int(seconds * rate)
+    samples = array("h", (int(8000 * math.sin(2 * math.pi * freq * i / rate)) for i in range(n)))
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+
+
+def rss_bytes():
+    # Current resident set size; falls back to peak RSS where /proc is unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, q):
+    # Nearest-rank percentile of an unsorted list
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def slope(points):
+    # Least-squares slope of (t, value) points
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_v = sum(v for _, v in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if var == 0:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / var
+
+
+def trend(points, floor, rel):
+    # Projected growth over the run; flagged when it clears both thresholds and mostly rises
+    if len(points) < 3:
+        return {"start": points[0][1] if points else None, "end": points[-1][1] if points else None, "flag": False}
+    s = slope(points)
+    span = points[-1][0] - points[0][0]
+    growth = s * span
+    steps = [b[1] - a[1] for a, b in zip(points, points[1:])]
+    rising = sum(1 for d in steps if d > 0) / len(steps)
+    start = points[0][1]
+    flag = growth > max(floor, rel * abs(start)) and rising >= RISING_FRACTION
+    return {"start": start, "end": points[-1][1], "slope_per_hour": s * 3600, "growth": growth, "rising": rising, "flag": flag}
+
+
+class SoakRunner:
+    def __init__(self, duration=3600, sample_every=60, step_every=0.5, poll_interval=1.0, local_files=6,
+                 latency=0.005, catalog_size=5000, workdir=None, top=10, seed=0):
+        self.duration = duration
+        self.sample_every = sample_every
+        self.step_every = step_every
+        self.poll_interval = poll_interval
+        self.local_files = local_files
+        self.workdir = workdir
+        self.top = top
+        self.rng = random.Random(seed)
+        self.api = FakeSpotify(catalog_size=catalog_size, latency=latency, seed=seed)
+        self.latencies = {op: [] for op in OPERATIONS}  # Current interval only
+        self.errors = {op: 0 for op in OPERATIONS}
+        self.counts = {op: 0 for op in OPERATIONS}
+        self.samples = []
+        self.baseline = None  # tracemalloc snapshots: first (after warm-up) and previous
+        self.previous = None
+        self.steps = 0
+        self.root = None
+        self.app = None
+        self.started = None
+        self.closed = {}
+
+    def setup(self):
+        # Private working dir (token cache, feature index, WAVs), silent audio, hidden window
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        self.workdir = self.workdir or tempfile.mkdtemp(prefix="soak-")
+        os.makedirs(self.workdir, exist_ok=True)
+        os.chdir(self.workdir)
+        from hybrid_streamer_ps import HybridPlayer
+        self.root = tk.Tk()
+        self.root.withdraw()
+        self.app = HybridPlayer(self.root, client=self.api)
+        self.app.poll_interval = self.poll_interval
+        for i in range(self.local_files):
+            path = os.path.join(self.workdir, f"tone_{i}.wav")
+            write_tone(path, 220.0 * (i + 1))
+            self.app.local_playlist.append(path)
+            self.app.local_listbox.insert(tk.END, os.path.basename(path))
+
+    def timed(self, op, fn, *args):
+        # Run one operation, recording latency or the failure
+        start = time.perf_counter()
+        try:
+            fn(*args)
+        except Exception as e:
+            self.errors[op] += 1
+            print(f"Soak {op} error: {e}")
+        self.latencies[op].append(time.perf_counter() - start)
+        self.counts[op] += 1
+
+    def op_search(self):
+        self.app.search_var.set(f"soak query {self.rng.randrange(1000)}")
+        self.app.search_tracks()
+
+    def op_play(self):
+        if not self.app.track_data:
+            return
+        self.app.listbox.selection_clear(0, tk.END)
+        self.app.listbox.selection_set(self.rng.randrange(len(self.app.track_data)))
+        self.app.play_selected()
+
+    def op_chart(self):
+        if self.app.track_data:
+            self.app.visualize_audio_features(self.rng.choice(self.app.track_data)["id"])
+
+    def step(self):
+        # One operation per tick, round-robin, then reschedule
+        op = OPERATIONS[self.steps % len(OPERATIONS)]
+        fn = {"search": self.op_search, "play": self.op_play, "poll": self.app.poll_status,
+              "chart": self.op_chart, "local_switch": self.app.local_next}[op]
+        self.timed(op, fn)
+        self.root.update_idletasks()  # Let queued redraws happen inside the measured loop
+        self.steps += 1
+        if time.monotonic() - self.started < self.duration:
+            self.root.after(int(self.step_every * 1000), self.step)
+
+    def sample(self, reschedule=True):
+        # Memory, threads, figures, state sizes and per-op latency for the interval just ended
+        import matplotlib.pyplot as plt
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        entry = {
+            "t": time.monotonic() - self.started,
+            "rss": rss_bytes(),
+            "traced": tracemalloc.get_traced_memory()[0],
+            "threads": threading.active_count(),
+            "figures": len(plt.get_fignums()),
+            "feature_vectors": len(self.app.feature_index),
+            "track_data": len(self.app.track_data),
+            "latency": {},
+        }
+        for op, values in self.latencies.items():
+            entry["latency"][op] = {"count": len(values), "p50": percentile(values, 0.5),
+                                    "p95": percentile(values, 0.95), "max": max(values) if values else None}
+            values.clear()
+        if self.previous is not None:
+            entry["top_growth"] = [
+                {"where": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in snapshot.compare_to(self.previous, "lineno")[:self.top] if stat.size_diff > 0
+            ]
+        if self.baseline is None and self.samples:
+            self.baseline = snapshot  # First sample is warm-up (imports, caches); compare against the second
+        self.previous = snapshot
+        self.samples.append(entry)
+        print(f"[soak {entry['t']:7.0f}s] rss={entry['rss'] / 2**20:.1f}MB traced={entry['traced'] / 2**20:.1f}MB "
+              f"threads={entry['threads']} figures={entry['figures']} vectors={entry['feature_vectors']}")
+        if reschedule and time.monotonic() - self.started < self.duration:
+            self.root.after(int(self.sample_every * 1000), self.sample)
+
+    def finish(self):
+        # Final sample, then close the app and check that its threads actually stopped
+        self.sample(reschedule=False)
+        status_thread = self.app.status_thread
+        threads_before = threading.active_count()
+        self.app.on_closing()
+        self.closed = {
+            "status_thread_stopped": not (status_thread and status_thread.is_alive()),
+            "threads_before_close": threads_before,
+            "threads_after_close": threading.active_count(),
+        }
+
+    def run(self):
+        # Drive the real mainloop: the status thread's Tk calls need it, as in normal use
+        tracemalloc.start()
+        self.setup()
+        self.started = time.monotonic()
+        self.sample()
+        self.root.after(int(self.step_every * 1000), self.step)
+        self.root.after(int(self.duration * 1000), self.finish)
+        self.root.mainloop()
+        tracemalloc.stop()
+        return self.report()
+
+    def report(self):
+        # Trends across samples (warm-up sample excluded when there are enough) plus top growth sites
+        samples = self.samples[1:] if len(self.samples) > 3 else self.samples
+        trends = {}
+        for metric, (floor, rel) in TREND_LIMITS.items():
+            trends[metric] = trend([(s["t"], s[metric]) for s in samples], floor, rel)
+        for op in OPERATIONS:
+            points = [(s["t"], s["latency"][op]["p95"]) for s in samples if s["latency"][op]["p95"] is not None]
+            trends[f"latency_p95.{op}"] = trend(points, *LATENCY_LIMIT)
+        growth = []
+        if self.baseline is not None and self.previous is not None:
+            growth = [{"where": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                      for stat in self.previous.compare_to(self.baseline, "lineno")[:self.top] if stat.size_diff > 0]
+        return {
+            "duration": self.duration,
+            "steps": self.steps,
+            "operations": self.counts,
+            "errors": self.errors,
+            "api_calls": self.api.calls,
+            "flags": sorted(k for k, v in trends.items() if v["flag"]),
+            "trends": trends,
+            "top_growth_since_baseline": growth,
+            "shutdown": self.closed,
+            "samples": self.samples,
+        }
+
+
+def format_report(report):
+    # Plain-text summary of a soak report
+    lines = [f"Soak: {report['duration']}s, {report['steps']} steps, {report['api_calls']} API calls",
+             "Operations: " + ", ".join(f"{op}={n} ({report['errors'][op]} errors)" for op, n in report["operations"].items())]
+    for metric, t in report["trends"].items():
+        if t.get("start") is None:
+            continue
+        mark = "FLAG" if t["flag"] else "ok  "
+        lines.append(f"  {mark} {metric:<24} start={t['start']:.4g} end={t['end']:.4g} per-hour={t.get('slope_per_hour', 0):+.4g}")
+    lines.append("Top allocation growth since baseline:")
+    for g in report["top_growth_since_baseline"]:
+        lines.append(f"  +{g['size_diff'] / 1024:.1f} KiB ({g['count_diff']:+d} blocks) {g['where']}")
+    shutdown = report["shutdown"]
+    if shutdown:
+        lines.append(f"Shutdown: status thread stopped={shutdown['status_thread_stopped']}, "
+                     f"threads {shutdown['threads_before_close']} -> {shutdown['threads_after_close']}")
+    lines.append("Flags: " + (", ".join(report["flags"]) or "none"))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless soak test of HybridPlayer against a local API stand-in")
+    parser.add_argument("--duration", type=float, default=3600, help="Seconds to run")
+    parser.add_argument("--sample-every", type=float, default=60, help="Seconds between samples")
+    parser.add_argument("--step-every", type=float, default=0.5, help="Seconds between operations")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Status thread poll interval")
+    parser.add_argument("--latency", type=float, default=0.005, help="Simulated API latency (s)")
+    parser.add_argument("--catalog-size", type=int, default=5000, help="Distinct tracks in the stand-in")
+    parser.add_argument("--workdir", help="Working directory (default: new temp dir)")
+    parser.add_argument("--json", help="Write the full report here")
+    args = parser.parse_args(argv)
+    json_path = os.path.abspath(args.json) if args.json else None
+    runner = SoakRunner(duration=args.duration, sample_every=args.sample_every, step_every=args.step_every,
+                        poll_interval=args.poll_interval, latency=args.latency, catalog_size=args.catalog_size,
+                        workdir=args.workdir)
+    try:
+        report = runner.run()
+    except tk.TclError as e:
+        print(f"Soak needs a display for the hidden Tk window (try xvfb-run): {e}")
+        return 2
+    print(format_report(report))
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["flags"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
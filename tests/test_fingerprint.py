@@ -0,0 +1,100 @@
+import wave
+
+import numpy as np
+import pytest
+
+from fingerprint import FingerprintIndex, SAMPLE_RATE, peak_hashes, spectral_peaks
+
+
+def song(seed, seconds=10.0):
+    # Chords and a bass line on an equal-tempered scale: peaks share few frequencies, like real music
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    out = np.zeros(n, dtype=np.float32)
+    beat = 60.0 / rng.uniform(70, 160)
+    root = rng.integers(36, 60)
+    scale = np.array([0, 2, 3, 5, 7, 8, 10, 12, 14, 15, 17, 19])
+    start = 0
+    while start < n:
+        length = min(int(beat * rng.choice([0.5, 1.0, 1.0, 2.0]) * SAMPLE_RATE), n - start)
+        t = np.arange(length, dtype=np.float32) / SAMPLE_RATE
+        midi = np.r_[root + rng.choice(scale, 3), root - 12]
+        freqs = 440.0 * 2 ** ((midi - 69) / 12)
+        freqs = np.r_[freqs, 2 * freqs]
+        amps = np.r_[np.ones(4), 0.5 * np.ones(4)] * rng.uniform(0.5, 1.0, 8)
+        out[start:start + length] = np.exp(-t * rng.uniform(2, 6)) * (amps @ np.sin(2 * np.pi * np.outer(freqs, t)))
+        start += length
+    return out / np.abs(out).max()
+
+
+def copy_of(samples, rng):
+    # Another rip of the same recording: shifted start, duller, different level, noisy
+    shift = int(rng.integers(-SAMPLE_RATE, SAMPLE_RATE))
+    s = samples[shift:] if shift > 0 else np.r_[np.zeros(-shift, dtype=np.float32), samples]
+    s = np.convolve(s, np.ones(3) / 3, mode="same") * rng.uniform(0.5, 1.2)
+    return (s + rng.normal(0, 0.02, len(s))).astype(np.float32)
+
+
+def test_planted_duplicates_found_at_library_scale(tmp_path):
+    # 1100 files: 1059 distinct songs, 30 copied once and one copied 11 times (more than any fixed posting cap)
+    index = FingerprintIndex(path=None)
+    rng = np.random.default_rng(0)
+    groups = []
+    def add(name, samples):
+        # Fingerprint in-process; paths don't exist, so update() keeps the entries
+        index.entries[str(tmp_path / name)] = (0.0, 0, *peak_hashes(*spectral_peaks(samples)))
+        return str(tmp_path / name)
+    for i in range(1059):
+        samples = song(i)
+        group = {add(f"song{i}.wav", samples)}
+        copies = 1 if i < 30 else 11 if i == 30 else 0
+        group |= {add(f"song{i}_copy{c}.wav", copy_of(samples, rng)) for c in range(copies)}
+        if copies:
+            groups.append(group)
+    found = [set(members) for members, score in index.find_duplicates(list(index.entries))]
+    assert sorted(found, key=sorted) == sorted(groups, key=sorted)
+
+
+def test_find_duplicates_decodes_wav_files(tmp_path):
+    rng = np.random.default_rng(1)
+    def write(name, samples, rate):
+        path = str(tmp_path / name)
+        if rate != SAMPLE_RATE:
+            samples = np.interp(np.arange(int(len(samples) * rate / SAMPLE_RATE)) * SAMPLE_RATE / rate, np.arange(len(samples)), samples)
+        with wave.open(path, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes((np.clip(samples, -1, 1) * 32000).astype(np.int16).tobytes())
+        return path
+    original = song(100)
+    paths = [write("a.wav", original, SAMPLE_RATE), write("b.wav", copy_of(original, rng), 22050),
+             write("c.wav", song(101), SAMPLE_RATE)]
+    index = FingerprintIndex(path=str(tmp_path / "fingerprints.npz"), workers=1)
+    groups = index.find_duplicates(paths)
+    assert [sorted(members) for members, score in groups] == [paths[:2]]
+    # The cache round-trips
+    assert all(FingerprintIndex(path=str(tmp_path / "fingerprints.npz")).is_current(p) for p in paths)
+
+
+def test_stop_cancels_queued_files_and_keeps_finished_ones(tmp_path):
+    paths = []
+    for i in range(40):
+        paths.append(str(tmp_path / f"{i}.wav"))
+        with wave.open(paths[-1], "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes((song(i, seconds=5.0) * 32000).astype(np.int16).tobytes())
+    index = FingerprintIndex(path=str(tmp_path / "fingerprints.npz"), workers=1)
+    seen = []
+    def progress(done, total):
+        seen.append(done)
+        index.stop()  # As on_closing does, from another thread, after the first file
+    with pytest.raises(InterruptedError):
+        index.find_duplicates(paths, progress=progress)
+    assert seen == [1]
+    # Only files already handed to the worker were fingerprinted; those kept are cached
+    assert 1 <= len(index.entries) <= 5
+    cached = FingerprintIndex(path=str(tmp_path / "fingerprints.npz"))
+    assert set(cached.entries) == set(index.entries)
@@ -0,0 +1,67 @@
+import pytest
+from spotipy.exceptions import SpotifyException
+
+from local_matcher import MIN_SCORE, LocalMatcher, parse_filename
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("50 Cent - In Da Club.mp3", {"artist": "50 Cent", "title": "In Da Club"}),
+    ("A1 - Caught in the Middle.mp3", {"artist": "A1", "title": "Caught in the Middle"}),
+    ("01 - Daft Punk - One More Time.mp3", {"artist": "Daft Punk", "title": "One More Time"}),
+    ("01 Artist - Title.mp3", {"artist": "Artist", "title": "Title"}),
+    ("02. Song_Name.ogg", {"title": "Song Name"}),
+    ("3) Intro.mp3", {"title": "Intro"}),
+    ("2.5 Hours.mp3", {"title": "2.5 Hours"}),
+])
+def test_parse_filename_track_numbers(name, expected):
+    assert parse_filename(name) == expected
+
+
+class FakeSearch:
+    def __init__(self, tracks=(), error=None):
+        self.tracks = list(tracks)
+        self.error = error
+        self.calls = 0
+
+    def search(self, q, type="track", limit=10):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return {"tracks": {"items": self.tracks}}
+
+
+def track(name, artist, duration_ms=200000):
+    return {"id": name, "uri": f"spotify:track:{name}", "name": name, "artists": [{"name": artist}], "duration_ms": duration_ms}
+
+
+def test_title_alone_is_not_a_match(tmp_path):
+    path = tmp_path / "Intro.mp3"
+    path.write_bytes(b"")
+    matcher = LocalMatcher(FakeSearch([track("Intro", "Some Random Band")]), index_path=str(tmp_path / "index.json"), rate=None)
+    assert matcher.match([str(path)]) == (0, 1)
+    record = matcher.tracks[str(path)]
+    assert record["uri"] is None and record["score"] < MIN_SCORE
+
+
+def test_stop_skips_queued_files(tmp_path):
+    paths = [tmp_path / f"Artist - Song {i}.mp3" for i in range(20)]
+    for p in paths:
+        p.write_bytes(b"")
+    sp = FakeSearch([track("Song 0", "Artist")])
+    matcher = LocalMatcher(sp, index_path=str(tmp_path / "index.json"), rate=None, workers=1)
+    search = sp.search
+    def search_then_stop(*args, **kwargs):
+        matcher.stop()  # Stop arrives while the first file is searching
+        return search(*args, **kwargs)
+    sp.search = search_then_stop
+    matcher.match([str(p) for p in paths])
+    # The in-flight file finishes; every queued one bails out before reading or searching
+    assert list(matcher.tracks) == [str(paths[0])] and sp.calls == 1
+
+
+def test_no_local_retry_without_bucket(tmp_path):
+    sp = FakeSearch(error=SpotifyException(429, -1, "rate limited", headers={"Retry-After": "5"}))
+    matcher = LocalMatcher(sp, index_path=str(tmp_path / "index.json"), rate=None)
+    with pytest.raises(SpotifyException):
+        matcher.search("artist song")
+    assert sp.calls == 1
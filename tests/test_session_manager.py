@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+from session_manager import SessionManager, BACKGROUND
+
+
+class SlowClient:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def search(self, q, **kwargs):
+        time.sleep(self.delay)
+        return q
+
+    def pause_playback(self):
+        return "paused"
+
+
+class RateLimitedOnce:
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        self.calls = 0
+
+    def pause_playback(self):
+        self.calls += 1
+        if self.calls == 1:
+            raise SpotifyException(429, -1, "rate limited", headers={"Retry-After": str(self.retry_after)})
+        return "paused"
+
+
+@pytest.fixture
+def manager():
+    managers = []
+    def make(**kwargs):
+        m = SessionManager(**kwargs)
+        managers.append(m)
+        return m
+    yield make
+    for m in managers:
+        m.shutdown(wait=False)
+
+
+def test_interactive_skips_background_backlog_when_workers_busy(manager):
+    m = manager(rate=1000, burst=1000, workers=4)
+    m.add_account("a", client=SlowClient(delay=0.2))
+    m.add_account("b", client=SlowClient())
+    background = [m.submit("a", "search", f"q{i}", priority=BACKGROUND) for i in range(40)]
+    time.sleep(0.05)
+    # Jobs wait in the manager's queues, not in the pool, so stats see them
+    assert m.stats()["a"]["queued"]["background"] >= 30
+    start = time.monotonic()
+    assert m.call("b", "pause_playback") == "paused"
+    assert time.monotonic() - start < 0.35  # At most one in-flight background call ahead of it
+    for future in background:
+        future.cancel()
+
+
+def test_429_drains_shared_bucket_and_requeues(manager):
+    m = manager(rate=100, burst=1)
+    client = RateLimitedOnce(retry_after=0.3)
+    m.add_account("a", client=client)
+    start = time.monotonic()
+    assert m.call("a", "pause_playback") == "paused"
+    assert time.monotonic() - start >= 0.3
+    assert client.calls == 2  # Requeued once, retried after the bucket refilled
+    stats = m.stats()["a"]
+    assert (stats["completed"], stats["failed"]) == (1, 0)
+
+
+class StaticToken:
+    def get_access_token(self, as_dict=False):
+        return "token"
+
+
+def test_spotipy_client_surfaces_429_to_manager(manager):
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            if len(hits) == 1:
+                self.send_response(429)
+                self.send_header("Retry-After", "0.2")
+                self.end_headers()
+                return
+            body = json.dumps({"tracks": {"items": []}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        m = manager(rate=100, burst=5)
+        penalties = []
+        penalize = m.bucket.penalize
+        m.bucket.penalize = lambda seconds: (penalties.append(seconds), penalize(seconds))
+        m.add_account("a", auth_manager=StaticToken())
+        m.sessions["a"].client.prefix = f"http://127.0.0.1:{server.server_port}/"
+        assert m.call("a", "search", q="x", type="track") == {"tracks": {"items": []}}
+        assert len(hits) == 2
+        assert penalties == [0.2]  # The retry went through the manager, not spotipy's own backoff
+    finally:
+        server.shutdown()
+
+
+class CountingClient:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def search(self, q):
+        self.calls += 1
+        time.sleep(self.delay)
+        return q
+
+
+def test_cancelled_jobs_are_never_called(manager):
+    m = manager(rate=1000, burst=1000, workers=1)
+    client = CountingClient(delay=0.2)
+    m.add_account("a", client=client)
+    first = m.submit("a", "search", "running")
+    time.sleep(0.05)  # The only worker is busy with it
+    queued = [m.submit("a", "search", f"q{i}", priority=BACKGROUND) for i in range(10)]
+    assert all(f.cancel() for f in queued)
+    last = m.submit("a", "search", "after", priority=BACKGROUND)  # Queued behind the cancelled ones
+    assert first.result() == "running" and last.result() == "after"
+    assert client.calls == 2
+    stats = m.stats()["a"]
+    assert (stats["completed"], stats["failed"]) == (2, 0)
@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+
+from similarity import FeatureIndex
+
+
+def wait_for_build(index, timeout=30):
+    deadline = time.monotonic() + timeout
+    while index.building and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not index.building
+
+
+def test_ivf_builds_in_background_and_assigns_new_rows():
+    rng = np.random.default_rng(0)
+    data = rng.random((6000, 7), dtype=np.float32)
+    index = FeatureIndex(path=None, approx_threshold=4000)
+    exact = FeatureIndex(path=None, approx_threshold=10**9)
+    index.add_many((f"t{i}", data[i]) for i in range(5000))
+    exact.add_many((f"t{i}", data[i]) for i in range(5000))
+    # First query past the threshold answers exactly and starts the build off-thread
+    assert index.centroids is None
+    assert index.similar("t0", 5) == exact.similar("t0", 5)
+    wait_for_build(index)
+    assert index.centroids is not None and index.indexed_count == 5000
+    # New rows are assigned to existing lists without a rebuild
+    index.add_many((f"t{i}", data[i]) for i in range(5000, 5300))
+    assert index.indexed_count == 5000
+    exact.add_many((f"t{i}", data[i]) for i in range(5000, 5300))
+    hits = [index.similar(f"t{i}", 1)[0][0] == exact.similar(f"t{i}", 1)[0][0] for i in range(5000, 5100)]
+    assert sum(hits) >= 90
+
+
+def test_save_load_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    data = rng.random((3000, 7), dtype=np.float32)
+    index = FeatureIndex(path=str(tmp_path / "features.npz"))
+    index.add_many((f"t{i}", data[i]) for i in range(3000))
+    index.save()
+    loaded = FeatureIndex(path=str(tmp_path / "features.npz"))
+    assert len(loaded) == 3000 and loaded.rows == index.rows
+    assert np.array_equal(loaded.get("t42"), data[42])
+    assert loaded.similar("t7", 5) == index.similar("t7", 5)
+    loaded.add("t3000", data[0])  # Appends after a load keep working
+    assert loaded.rows["t3000"] == 3000
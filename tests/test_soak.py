@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from similarity import FEATURES
+from soak import OPERATIONS, FakeSpotify, SoakRunner, format_report, trend
+
+
+def test_trend_flags_steady_growth_only():
+    rising = [(t * 60.0, 100e6 + t * 2e6) for t in range(10)]
+    assert trend(rising, floor=8e6, rel=0.1)["flag"]
+    # Same end value, but one early jump then flat: mostly not rising
+    step = [(t * 60.0, 100e6 if t == 0 else 118e6) for t in range(10)]
+    assert not trend(step, floor=8e6, rel=0.1)["flag"]
+    # Rising every step but below the absolute floor
+    small = [(t * 60.0, 100e6 + t * 1e5) for t in range(10)]
+    assert not trend(small, floor=8e6, rel=0.0)["flag"]
+    noisy = [(t * 60.0, 100e6 + (3e6 if t % 2 else -3e6)) for t in range(10)]
+    assert not trend(noisy, floor=8e6, rel=0.1)["flag"]
+    assert trend(rising[:2], floor=0, rel=0) == {"start": 100e6, "end": 102e6, "flag": False}
+    assert trend([], floor=0, rel=0)["flag"] is False
+
+
+def test_fake_spotify_is_deterministic_and_tracks_playback():
+    api = FakeSpotify(catalog_size=100, latency=0, track_change=0.0)
+    items = api.search("some query", limit=5)["tracks"]["items"]
+    assert items == FakeSpotify(catalog_size=100, latency=0).search("some query", limit=5)["tracks"]["items"]
+    assert len({t["id"] for t in items}) == 5
+    features = api.audio_features([t["id"] for t in items])
+    assert [f["id"] for f in features] == [t["id"] for t in items]
+    assert all(0.0 <= f[name] <= 1.0 for f in features for name in FEATURES)
+    assert api.audio_features(items[0]["id"]) == features[:1]
+    assert api.current_playback() is None
+    api.start_playback(uris=[items[2]["uri"]])
+    playback = api.current_playback()
+    assert playback["is_playing"] and playback["item"]["id"] == items[2]["id"]
+    api.pause_playback()
+    assert not api.current_playback()["is_playing"]
+    assert api.calls == 8
+
+
+@pytest.mark.skipif(not os.environ.get("DISPLAY"), reason="needs an X display (e.g. xvfb-run)")
+def test_soak_runner_short_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # setup() chdirs into the work dir; restored afterwards
+    runner = SoakRunner(duration=4, sample_every=1, step_every=0.05, poll_interval=0.2, local_files=2,
+                        latency=0.0, catalog_size=200, workdir=str(tmp_path / "soak"))
+    report = runner.run()
+    assert report["steps"] >= len(OPERATIONS)
+    assert all(report["operations"][op] for op in OPERATIONS)
+    assert not any(report["errors"].values())
+    assert len(report["samples"]) >= 3
+    assert report["shutdown"]["status_thread_stopped"]
+    assert "Shutdown" in format_report(report)